@@ -16,6 +16,7 @@ from sklearn.preprocessing import LabelEncoder
 from sklearn.metrics import mean_squared_error
 import optuna
 from sklearn.metrics import ndcg_score
+from model_loader import save_native_model
 
 def make_model():
 
@@ -393,6 +394,9 @@ def make_model():
     filename = 'hanshin_shiba_3ageup_model.sav'
     pickle.dump(model, open(filename, 'wb'))
     print("モデルを保存しました")
+    # 予測側の高速読み込み用にLightGBMネイティブ形式(.txt)でも保存（古い.txtが残らないように毎回更新）
+    native_filename = save_native_model(model, filename)
+    print(f"ネイティブ形式モデルを {native_filename} に保存しました")
 
 
 if __name__ == '__main__':
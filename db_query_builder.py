@@ -779,7 +779,21 @@ def build_sokuho_race_data_query(
                              base_features.keibajo_code, base_features.race_bango
             )
             ELSE 0
-        END AS relative_ability
+        END AS relative_ability,
+        -- 距離適性スコア: 距離帯別スコアを距離差で重み付け平均（200mごとに0.8倍減衰、未経験は中立0.5）
+        -- feature_engineering.pyのPython側計算（行ごとのapply）をSQLに移したもの
+        -- COALESCEの0.5はdata_preprocessing.pyのpreprocess_race_data内fill_values（past_score_short/mile/middle/long → 0.5）と同じ値（変更時は両方そろえる）
+        (
+            POWER(0.8, ABS(cast(base_features.kyori as integer) - 1200) / 200.0) * COALESCE(base_features.past_score_short, 0.5)
+            + POWER(0.8, ABS(cast(base_features.kyori as integer) - 1600) / 200.0) * COALESCE(base_features.past_score_mile, 0.5)
+            + POWER(0.8, ABS(cast(base_features.kyori as integer) - 2100) / 200.0) * COALESCE(base_features.past_score_middle, 0.5)
+            + POWER(0.8, ABS(cast(base_features.kyori as integer) - 2600) / 200.0) * COALESCE(base_features.past_score_long, 0.5)
+        ) / (
+            POWER(0.8, ABS(cast(base_features.kyori as integer) - 1200) / 200.0)
+            + POWER(0.8, ABS(cast(base_features.kyori as integer) - 1600) / 200.0)
+            + POWER(0.8, ABS(cast(base_features.kyori as integer) - 2100) / 200.0)
+            + POWER(0.8, ABS(cast(base_features.kyori as integer) - 2600) / 200.0)
+        ) AS similar_distance_score
     FROM (
     select * from (
         select
@@ -21,6 +21,9 @@ from typing import Dict, List, Tuple, Optional
 import warnings
 warnings.filterwarnings('ignore')
 
+# レースを識別するカラム
+RACE_KEYS = ['kaisai_year', 'kaisai_date', 'keibajo_code', 'race_number']
+
 
 class ExpectedValueCalculator:
     """
@@ -124,14 +127,60 @@ class ExpectedValueCalculator:
         
         df['win_probability'] = probabilities
         
-        # 期待値を計算
-        df['expected_value'] = df.apply(
-            lambda row: self.calculate_expected_value(
-                row['win_probability'], 
-                row[odds_col]
-            ),
-            axis=1
-        )
+        return self._add_expected_value_columns(df, odds_col)
+    
+    def calculate_expected_values(
+        self,
+        df: pd.DataFrame,
+        race_keys: List[str] = RACE_KEYS,
+        prediction_col: str = 'predicted_score',
+        odds_col: str = 'tansho_odds'
+    ) -> pd.DataFrame:
+        """
+        複数レース分の全馬の期待値をまとめて計算
+        
+        calculate_race_expected_values()をレースごとに呼ぶのと同じ結果を、
+        レース内ソフトマックスをgroupby.transformで計算して一括で求める。
+        (行の並びは入力のまま)
+        
+        Args:
+            df (DataFrame): 複数レースのデータ (馬ごとの行)
+            race_keys (List[str]): レースを識別するカラム名
+            prediction_col (str): 予測スコアのカラム名
+            odds_col (str): オッズのカラム名
+            
+        Returns:
+            DataFrame: 期待値が追加されたデータフレーム
+        """
+        df = df.copy()
+        
+        # レース内ソフトマックス: exp(score - レース内最大) / レース内合計
+        scores = df[prediction_col]
+        race_max = scores.groupby([df[key] for key in race_keys]).transform('max')
+        exp_scores = np.exp(scores - race_max)
+        df['win_probability'] = exp_scores / exp_scores.groupby([df[key] for key in race_keys]).transform('sum')
+        
+        return self._add_expected_value_columns(df, odds_col)
+    
+    def _add_expected_value_columns(self, df: pd.DataFrame, odds_col: str) -> pd.DataFrame:
+        """
+        win_probabilityから期待値・購入推奨フラグ・期待リターンの列を追加
+        
+        calculate_expected_value()と同じ判定を列単位で行う。
+        
+        Args:
+            df (DataFrame): win_probability列を持つデータフレーム
+            odds_col (str): オッズのカラム名
+            
+        Returns:
+            DataFrame: 列を追加したデータフレーム (引数をそのまま更新)
+        """
+        probabilities = df['win_probability'].to_numpy(dtype=float)
+        odds = df[odds_col].to_numpy(dtype=float)
+        
+        # 期待値を計算 (勝率が範囲外・オッズが範囲外なら0)
+        invalid = (probabilities <= 0) | (probabilities > 1) | (odds < self.min_odds) | (odds > self.max_odds)
+        df['expected_value'] = np.where(invalid, 0.0, probabilities * odds)
         
         # 購入推奨フラグ
         df['should_buy'] = df['expected_value'] >= self.threshold
@@ -164,41 +213,26 @@ class ExpectedValueCalculator:
         """
         results = []
         
+        # 期待値は閾値に依存しないので全レース分を1回だけ計算しておく
+        df_ev = self.calculate_expected_values(
+            backtest_df,
+            prediction_col=prediction_col,
+            odds_col=odds_col
+        )
+        expected_values = df_ev['expected_value'].to_numpy()
+        is_win = (df_ev[result_col] == 1).to_numpy()
+        payouts = df_ev[odds_col].to_numpy(dtype=float) * 100
+        
         for threshold in threshold_range:
             # 閾値を設定
             self.threshold = threshold
             
-            # レースIDごとにグループ化して処理
-            race_groups = backtest_df.groupby(['kaisai_year', 'kaisai_date', 'keibajo_code', 'race_number'])
-            
-            total_bets = 0
-            total_wins = 0
-            total_investment = 0
-            total_return = 0
-            
-            for _, race_df in race_groups:
-                # レース内の期待値を計算
-                race_with_ev = self.calculate_race_expected_values(
-                    race_df, 
-                    prediction_col=prediction_col,
-                    odds_col=odds_col
-                )
-                
-                # 購入推奨馬を抽出
-                buy_horses = race_with_ev[race_with_ev['should_buy']]
-                
-                if len(buy_horses) == 0:
-                    continue
-                
-                # 購入処理
-                for _, horse in buy_horses.iterrows():
-                    total_bets += 1
-                    total_investment += 100  # 100円購入と仮定
-                    
-                    # 1着なら払い戻し
-                    if horse[result_col] == 1:
-                        total_wins += 1
-                        total_return += horse[odds_col] * 100
+            # 購入推奨馬 (期待値が閾値以上) に100円ずつ購入したと仮定
+            buy = expected_values >= threshold
+            total_bets = int(buy.sum())
+            total_wins = int((buy & is_win).sum())
+            total_investment = total_bets * 100
+            total_return = payouts[buy & is_win].sum()
             
             # 指標を計算
             hit_rate = (total_wins / total_bets * 100) if total_bets > 0 else 0
@@ -253,21 +287,12 @@ def analyze_expected_value_distribution(
     """
     calculator = ExpectedValueCalculator()
     
-    # レースIDごとにグループ化
-    race_groups = race_df.groupby(['kaisai_year', 'kaisai_date', 'keibajo_code', 'race_number'])
-    
-    all_horses = []
-    
-    for _, race in race_groups:
-        race_with_ev = calculator.calculate_race_expected_values(
-            race,
-            prediction_col=prediction_col,
-            odds_col=odds_col
-        )
-        all_horses.append(race_with_ev)
-    
-    # 全馬を統合
-    df_all = pd.concat(all_horses, ignore_index=True)
+    # 全レースの全馬の期待値をまとめて計算
+    df_all = calculator.calculate_expected_values(
+        race_df,
+        prediction_col=prediction_col,
+        odds_col=odds_col
+    ).reset_index(drop=True)
     
     # 期待値を区分
     df_all['ev_range'] = pd.cut(
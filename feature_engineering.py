@@ -50,10 +50,8 @@ def create_features(df):
     
     # 期待斤量からの差分（年齢別期待斤量との差）
     expected_weight_by_age = {2: 48, 3: 52, 4: 55, 5: 57, 6: 57, 7: 56, 8: 55}
-    df['futan_deviation'] = df.apply(
-        lambda row: row['futan_juryo'] - expected_weight_by_age.get(row['barei'], 55), 
-        axis=1
-    )
+    # 行ごとのapplyではなく、馬齢→期待斤量をmapで一括変換（該当なしは55kg）
+    df['futan_deviation'] = df['futan_juryo'] - df['barei'].map(expected_weight_by_age).fillna(55)
     X['futan_deviation'] = df['futan_deviation']
         
     return X
@@ -116,9 +114,6 @@ def add_advanced_features(
     X['current_direction_match'] = df['current_direction_match']
     log("    追加: left_direction_score, right_direction_score, current_direction_match")
     
-    # 時系列順にソート（必要な場合のみ使用）
-    df_sorted = df.sort_values(['ketto_toroku_bango', 'kaisai_nen', 'kaisai_tsukihi']).copy()
-    
     # ========================================
     # 1️⃣ 距離適性スコア
     # ========================================
@@ -126,26 +121,25 @@ def add_advanced_features(
     
     # 距離帯別スコアを重み付け平均で統合
     # 各距離帯の中心値から現在レースの距離までの差で重み付け
-    def get_distance_score_weighted(row):
-        kyori = row['kyori']
-        
+    # 速報クエリ(build_sokuho_race_data_query)ではSQL側で計算済みなのでそのまま使う
+    if 'similar_distance_score' not in df.columns:
         # 各距離帯の中心値（m）
-        centers = {'short': 1200, 'mile': 1600, 'middle': 2100, 'long': 2600}
+        distance_centers = np.array([1200, 1600, 2100, 2600], dtype=float)
+        past_scores = df[['past_score_short', 'past_score_mile', 'past_score_middle', 'past_score_long']].to_numpy(dtype=float)
         
-        scores, weights = [], []
-        for key, center in centers.items():
-            score = row.get(f'past_score_{key}')
-            if pd.notna(score):
-                # 距離差200mごとに重みを0.8倍に減衰
-                distance_diff = abs(kyori - center)
-                weight = 0.8 ** (distance_diff / 200)
-                scores.append(score)
-                weights.append(weight)
+        # 距離差200mごとに重みを0.8倍に減衰（全行×全距離帯を一括計算、実績がない距離帯は重み0）
+        distance_diff = np.abs(df['kyori'].to_numpy(dtype=float)[:, None] - distance_centers)
+        has_score = ~np.isnan(past_scores)
+        weights = np.where(has_score, 0.8 ** (distance_diff / 200), 0.0)
+        weight_sum = weights.sum(axis=1)
+        weighted_sum = (weights * np.where(has_score, past_scores, 0.0)).sum(axis=1)
         
         # 重み付け平均、実績がない場合は0.5（中立）
-        return np.average(scores, weights=weights) if len(scores) > 0 else 0.5
-    
-    df['similar_distance_score'] = df.apply(get_distance_score_weighted, axis=1)
+        # 0.5はdata_preprocessing.pyのpreprocess_race_data内fill_values（past_score_*・similar_distance_score → 0.5）と同じ値
+        # （SQL側 db_query_builder.build_sokuho_race_data_query のCOALESCEも同じ値、変更時はすべてそろえる）
+        df['similar_distance_score'] = np.where(
+            weight_sum > 0, weighted_sum / np.where(weight_sum > 0, weight_sum, 1.0), 0.5
+        )
     X['similar_distance_score'] = df['similar_distance_score']
     
     # SQL側で計算済みの特徴量をXに追加
@@ -195,39 +189,40 @@ def add_advanced_features(
     is_short = max_distance <= 1600
     is_long = min_distance >= 1700
     
+    # 削除する特徴量を集めて最後に1回だけdropする（dropのたびにDataFrameを作り直さない）
+    drop_columns = []
+    available_columns = set(X.columns)
+    
+    def mark_drop(feature, reason=''):
+        """削除対象に追加（Xに存在し、未登録のもののみ）"""
+        if feature in available_columns and feature not in drop_columns:
+            drop_columns.append(feature)
+            log(f"      削除: {feature}{reason}")
+    
     # 短距離専用特徴量の調整
     if is_short:
         log(f"    [短距離モデル] 短距離特化特徴量を使用")
         # 短距離では長距離特化特徴量を削除
-        if 'long_distance_experience_count' in X.columns:
-            X = X.drop(columns=['long_distance_experience_count'])
-            log(f"      削除: long_distance_experience_count")
+        mark_drop('long_distance_experience_count')
     else:
         log(f"    [中長距離モデル] 短距離特化特徴量を削除")
         # 中長距離では短距離特化特徴量を削除
-        features_to_remove_for_long = ['start_index', 'corner_position_score', 'zenso_kyori_sa']
-        for feature in features_to_remove_for_long:
-            if feature in X.columns:
-                X = X.drop(columns=[feature])
-                log(f"      削除: {feature}")
+        for feature in ['start_index', 'corner_position_score', 'zenso_kyori_sa']:
+            mark_drop(feature)
         
         # 長距離(2200m以上)では長距離特化特徴量を残す
         if min_distance >= 2200:
             log(f"    [長距離モデル] 長距離特化特徴量を使用")
         else:
             # 中距離では長距離特化特徴量も削除
-            if 'long_distance_experience_count' in X.columns:
-                X = X.drop(columns=['long_distance_experience_count'])
-                log(f"      削除: long_distance_experience_count")
-    
-    # 路面×距離別の特徴量削除
-    features_to_remove = []
+            mark_drop('long_distance_experience_count')
     
     # wakuban_kyori_interactionは短距離モデル専用なので、中長距離では削除
-    if not is_short and 'wakuban_kyori_interaction' in X.columns:
-        X = X.drop(columns=['wakuban_kyori_interaction'])
-        log(f"      削除: wakuban_kyori_interaction（中長距離では不要）")
+    if not is_short:
+        mark_drop('wakuban_kyori_interaction', '（中長距離では不要）')
     
+    # 路面×距離別の特徴量削除
+    features_to_remove = []
     if is_turf and is_long:
         log("    [芝中長距離] 全特徴量を使用（ベースモデル）")
     elif is_turf and is_short:
@@ -241,12 +236,35 @@ def add_advanced_features(
     else:
         log("    [中間距離] 全特徴量を使用")
     
-    if features_to_remove:
-        for feature in features_to_remove:
-            if feature in X.columns:
-                X = X.drop(columns=[feature])
-                log(f"      削除: {feature}")
+    for feature in features_to_remove:
+        mark_drop(feature)
+    
+    if drop_columns:
+        X = X.drop(columns=drop_columns)
     
     log(f"  [DONE] 最終特徴量数: {len(X.columns)}個")
     
     return X
+
+
+def downcast_features(X: pd.DataFrame) -> pd.DataFrame:
+    """
+    特徴量DataFrameの数値型を縮小（float64→float32、整数は最小の整数型）
+
+    予測直前に型を縮小してメモリ使用量と転送量を半減させる。
+    float32への丸めで分岐の閾値付近の値は予測が変わりうるため、
+    購入条件を調整するバックテスト（universal_test.py）と速報予測（sokuho_prediction.py）の
+    両方で同じように適用すること。
+
+    Args:
+        X (pd.DataFrame): 特徴量DataFrame
+
+    Returns:
+        pd.DataFrame: 型を縮小した特徴量DataFrame
+    """
+    float_columns = X.select_dtypes(include='float64').columns
+    if len(float_columns) > 0:
+        X = X.astype({col: np.float32 for col in float_columns})
+    for col in X.select_dtypes(include='integer').columns:
+        X[col] = pd.to_numeric(X[col], downcast='integer')
+    return X
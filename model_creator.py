@@ -14,6 +14,7 @@ from sklearn.metrics import ndcg_score
 from keiba_constants import get_track_name, format_model_description
 from datetime import datetime
 from db_query_builder import build_race_data_query
+from model_loader import save_native_model
 
 
 def create_universal_model(track_code, kyoso_shubetsu_code, surface_type, 
@@ -292,6 +293,9 @@ def create_universal_model(track_code, kyoso_shubetsu_code, surface_type,
     model_filepath = output_path / model_filename
     pickle.dump(model, open(model_filepath, 'wb'))
     print(f"[OK] モデルを {model_filepath} に保存しました")
+    # 予測側の高速読み込み用にLightGBMネイティブ形式(.txt)でも保存
+    native_filepath = save_native_model(model, model_filepath)
+    print(f"[OK] ネイティブ形式モデルを {native_filepath} に保存しました")
 
     # コネクションをクローズ
     conn.close()
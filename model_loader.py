@@ -0,0 +1,94 @@
+"""
+モデル読み込みの共通化モジュール
+
+sokuho_prediction.pyやuniversal_test.pyで共通のモデル読み込みロジックを提供します。
+model_creator.pyは学習済みLightGBMモデルをpickle(.sav)と並べて
+ネイティブのテキスト形式(.txt)でも保存するため、.txtがあればそちらを優先して読み込みます。
+（pickleの全デシリアライズより高速で、任意コード実行のリスクもない）
+"""
+
+import pickle
+from collections import OrderedDict
+from pathlib import Path
+
+# 読み込み済みモデルのキャッシュ（キー: ファイルパス、値: (更新時刻, モデル)）
+# 同じプロセス内で同じモデルを何度も使う場合（速報予測で同じモデルファイルを複数設定が使うなど）に
+# ディスク読み込みとデシリアライズを省略する。
+# 最近使った_MODEL_CACHE_SIZE個だけを保持し、ファイルが更新されたら古いモデルは置き換える
+_MODEL_CACHE = OrderedDict()
+_MODEL_CACHE_SIZE = 8
+
+
+def get_native_model_path(model_path):
+    """
+    pickleモデルのパスに対応するLightGBMネイティブ形式(.txt)のパスを返す
+
+    Args:
+        model_path (str | Path): モデルファイルのパス（例: models/xxx.sav）
+
+    Returns:
+        Path: ネイティブ形式モデルのパス（例: models/xxx.txt）
+    """
+    return Path(str(model_path)).with_suffix('.txt')
+
+
+def save_native_model(model, model_path):
+    """
+    LightGBM Boosterをネイティブのテキスト形式で保存
+
+    Args:
+        model (lgb.Booster): 学習済みモデル
+        model_path (str | Path): pickleモデルのパス（拡張子を.txtに置き換えて保存）
+
+    Returns:
+        Path: 保存先のパス
+    """
+    native_path = get_native_model_path(model_path)
+    model.save_model(str(native_path))
+    return native_path
+
+
+def load_model(model_path):
+    """
+    学習済みモデルを読み込む
+
+    同名の.txt（LightGBMネイティブ形式）が.savと同じかそれより新しければlgb.Boosterとして読み込み、
+    なければ従来通りpickleから読み込む。
+    （.savだけ再学習・差し替えされた場合に古い.txtを使い続けないようにする）
+    一度読み込んだモデルはファイルの更新時刻が変わるまでプロセス内でキャッシュする（最近使った数個のみ）。
+
+    Args:
+        model_path (str | Path): モデルファイルのパス（.sav）
+
+    Returns:
+        学習済みモデル（lgb.Booster）
+    """
+    pickle_path = Path(str(model_path))
+    native_path = get_native_model_path(model_path)
+    use_native = native_path.exists()
+    if use_native and pickle_path.exists() and native_path.stat().st_mtime < pickle_path.stat().st_mtime:
+        print(f"[WARNING] {native_path} は {pickle_path} より古いため、pickleから読み込みます")
+        use_native = False
+    load_path = native_path if use_native else pickle_path
+
+    # ファイルが更新されていなければキャッシュ済みのモデルを返す
+    cache_key = str(load_path)
+    mtime = load_path.stat().st_mtime
+    cached = _MODEL_CACHE.get(cache_key)
+    if cached is not None and cached[0] == mtime:
+        _MODEL_CACHE.move_to_end(cache_key)
+        return cached[1]
+
+    if use_native:
+        import lightgbm as lgb
+        model = lgb.Booster(model_file=str(load_path))
+    else:
+        with open(load_path, 'rb') as model_file:
+            model = pickle.load(model_file)
+
+    # 同じパスの古いモデルは置き換え、上限を超えたら最も長く使われていないモデルを捨てる
+    _MODEL_CACHE[cache_key] = (mtime, model)
+    _MODEL_CACHE.move_to_end(cache_key)
+    while len(_MODEL_CACHE) > _MODEL_CACHE_SIZE:
+        _MODEL_CACHE.popitem(last=False)
+    return model
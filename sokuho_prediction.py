@@ -9,22 +9,25 @@
 Usage:
     python sokuho_prediction.py --model standard
     python sokuho_prediction.py --model custom tokyo_turf_3ageup_long
+    python sokuho_prediction.py --model standard --workers 4
 """
 
 import psycopg2
 import pandas as pd
-import pickle
 import numpy as np
+from scipy.special import expit
 import os
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import logging
 from pathlib import Path
 from datetime import datetime
-from keiba_constants import get_track_name, format_model_description, get_surface_name
+from keiba_constants import get_track_name, format_model_description, get_surface_name, TRACK_CODES, SURFACE_TYPES
 from model_config_loader import get_all_models, get_custom_models
 from db_query_builder import build_sokuho_race_data_query
 from data_preprocessing import preprocess_race_data
-from feature_engineering import create_features, add_advanced_features
+from feature_engineering import create_features, add_advanced_features, downcast_features
+from model_loader import load_model
 
 # ロギング設定
 logging.basicConfig(
@@ -37,6 +40,62 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 出力の文字列列用カテゴリ型（値の種類が決まっているので、出力DataFrameを小さくしgroupbyのキーも軽くする）
+# 競馬場名はSQLのCASE式で該当なしの場合に''になる
+TRACK_NAME_DTYPE = pd.CategoricalDtype(categories=list(TRACK_CODES.values()) + [''])
+SURFACE_NAME_DTYPE = pd.CategoricalDtype(categories=list(SURFACE_TYPES.values()) + ['不明'])
+
+# 速報データ取得結果のキャッシュ（キー: SQL文字列）
+# 距離帯・競走種別が同じモデル設定ではDBへの問い合わせを1回で済ませる
+_RACE_DATA_CACHE = {}
+
+# スキップ理由（add_sokuho_purchase_logicで判定する優先度の高い順）
+SKIP_REASONS = [
+    'low_score_diff',
+    'odds_too_high',
+    'odds_too_low',
+    'low_popularity',
+    'low_predicted_rank',
+    'multiple_conditions',
+]
+
+
+def create_db_connection():
+    """
+    速報予測用のPostgreSQL接続を作成
+    
+    Returns:
+        psycopg2 connection: DB接続
+    """
+    return psycopg2.connect(
+        dbname='keiba',
+        user='postgres',
+        password='ahtaht88',
+        host='localhost',
+        port=5432
+    )
+
+
+def ensure_db_connection(conn=None):
+    """
+    使い回すDB接続が生きていればそのまま返し、切断されていれば再接続する
+    
+    Args:
+        conn: 使い回しているDB接続（Noneなら新規に接続）
+        
+    Returns:
+        psycopg2 connection: DB接続（再接続にも失敗した場合はNone）
+    """
+    if conn is not None and not conn.closed:
+        return conn
+    if conn is not None:
+        logger.warning("[WARNING] DB接続が切断されていたため再接続します")
+    try:
+        return create_db_connection()
+    except psycopg2.Error as e:
+        logger.error(f"[ERROR] DB接続エラー: {type(e).__name__}: {str(e)}")
+        return None
+
 
 def add_sokuho_purchase_logic(
     output_df: pd.DataFrame,
@@ -60,94 +119,62 @@ def add_sokuho_purchase_logic(
     Returns:
         DataFrame: 購入ロジックが追加されたデータフレーム
     """
-    df = output_df.copy()
-    
-    # カラム名をマッピング (日本語 → 英語)
-    df_work = df.rename(columns={
-        '開催年': 'kaisai_year',
-        '開催日': 'kaisai_date',
-        '競馬場': 'keibajo_code',
-        'レース番号': 'race_number',
-        '馬番': 'umaban_numeric',
-        '予測順位': 'predicted_rank',
-        '予測スコア': 'predicted_score',
-        '人気順': 'popularity_rank',
-        '単勝オッズ': 'tansho_odds'
-    })
-    
-    # レースごとにグループ化して処理
-    race_groups = df_work.groupby(['kaisai_year', 'kaisai_date', 'keibajo_code', 'race_number'])
-    
-    all_races = []
-    total_recommended = 0
-    
-    for race_id, race_df in race_groups:
-        race_df = race_df.copy()
-        
-        # 予測スコアでソート(降順)
-        race_df_sorted = race_df.sort_values('predicted_score', ascending=False).reset_index(drop=True)
-        
-        # 予測1位と2位のスコア差を計算
-        if len(race_df_sorted) >= 2:
-            score_diff = race_df_sorted.iloc[0]['predicted_score'] - race_df_sorted.iloc[1]['predicted_score']
-        else:
-            score_diff = 0
-        
-        # 全馬にレース情報を追加
-        race_df['score_diff'] = score_diff
-        race_df['skip_reason'] = None
-        
-        # フィルター1: 予測スコア差が小さいレースはスキップ
-        if score_diff < min_score_diff:
-            race_df['購入推奨'] = False
-            race_df['skip_reason'] = 'low_score_diff'
-            all_races.append(race_df)
-            continue
-        
-        # フィルター2: 予測順位 AND 人気順 AND オッズ範囲
-        race_df['購入推奨'] = (
-            (race_df['predicted_rank'] <= prediction_rank_max) &
-            (race_df['popularity_rank'] <= popularity_rank_max) &
-            (race_df['tansho_odds'] >= min_odds) &
-            (race_df['tansho_odds'] <= max_odds)
-        )
-        
-        # スキップ理由を記録（優先順位順に判定）
-        race_df.loc[~race_df['購入推奨'] & (race_df['predicted_rank'] > prediction_rank_max), 'skip_reason'] = 'low_predicted_rank'
-        race_df.loc[~race_df['購入推奨'] & (race_df['popularity_rank'] > popularity_rank_max), 'skip_reason'] = 'low_popularity'
-        race_df.loc[~race_df['購入推奨'] & (race_df['tansho_odds'] < min_odds), 'skip_reason'] = 'odds_too_low'
-        race_df.loc[~race_df['購入推奨'] & (race_df['tansho_odds'] > max_odds), 'skip_reason'] = 'odds_too_high'
-        
-        # 購入推奨がFalseでskip_reasonがまだNoneの場合は「複合条件」として記録
-        race_df.loc[~race_df['購入推奨'] & race_df['skip_reason'].isna(), 'skip_reason'] = 'multiple_conditions'
-        
-        # 購入推奨馬を抽出
-        buy_horses = race_df[race_df['購入推奨']].copy()
-        total_recommended += len(buy_horses)
-        
-        all_races.append(race_df)
-    
-    # 全レースを統合
-    df_integrated = pd.concat(all_races, ignore_index=True)
-    
-    # カラム名を日本語に戻す
-    df_integrated = df_integrated.rename(columns={
-        'kaisai_year': '開催年',
-        'kaisai_date': '開催日',
-        'keibajo_code': '競馬場',
-        'race_number': 'レース番号',
-        'umaban_numeric': '馬番',
-        'predicted_rank': '予測順位',
-        'predicted_score': '予測スコア',
-        'popularity_rank': '人気順',
-        'tansho_odds': '単勝オッズ',
-        'score_diff': 'スコア差',
-        'skip_reason': 'スキップ理由'
-    })
+    # 日本語のカラム名のまま処理する（英語名への往復renameはしない）
+    # 新しい列を追加するだけなので、呼び出し元のデータフレームとは別の枠を用意する
+    df_work = output_df.reset_index(drop=True)
+    
+    # レース単位のグループ（ループせず、transformで全行に展開して計算する）
+    # 4つのキー列のハッシュは1回だけ行い、以降の集計は整数のレースIDでグループ化する
+    race_keys = ['開催年', '開催日', '競馬場', 'レース番号']
+    race_id = df_work.groupby(race_keys, observed=True).ngroup().to_numpy()
+    predicted_score = df_work['予測スコア']
+    race_groups = predicted_score.groupby(race_id)
+    
+    # 予測1位と2位のスコア差を計算（1頭立てのレースは0）
+    # レース内ソートはせず、最大値と「最大値未満の最大値」から2位を求める（最大値が同点なら2位も同じ値）
+    top1_score = race_groups.transform('max')
+    is_top1 = predicted_score == top1_score
+    top1_count = is_top1.groupby(race_id).transform('sum')
+    below_top1 = predicted_score.where(~is_top1).groupby(race_id).transform('max')
+    top2_score = top1_score.where(top1_count >= 2, below_top1)
+    race_size = race_groups.transform('size')
+    df_work['スコア差'] = np.where(race_size >= 2, top1_score - top2_score, 0)
+    
+    # フィルター1: 予測スコア差が小さいレースはスキップ
+    low_score_diff = (df_work['スコア差'] < min_score_diff).to_numpy()
+    
+    # フィルター2: 予測順位 AND 人気順 AND オッズ範囲
+    # numexprがインストールされていればpandas.evalが1パスで計算する
+    candidate = df_work.eval(
+        "(`予測順位` <= @prediction_rank_max) & (`人気順` <= @popularity_rank_max)"
+        " & (`単勝オッズ` >= @min_odds) & (`単勝オッズ` <= @max_odds)"
+    ).to_numpy(dtype=bool)
+    buy = candidate & ~low_score_diff
+    not_buy = ~buy & ~low_score_diff
+    
+    # スキップ理由を記録（np.selectは先に一致した条件を採用するので、優先度の高い順に並べる）
+    # 文字列ではなくint8のコードで判定し、最後にカテゴリ型へ一括変換（購入推奨は-1=欠損）
+    skip_reason_codes = np.select(
+        [
+            low_score_diff,
+            not_buy & (df_work['単勝オッズ'] > max_odds).to_numpy(),
+            not_buy & (df_work['単勝オッズ'] < min_odds).to_numpy(),
+            not_buy & (df_work['人気順'] > popularity_rank_max).to_numpy(),
+            not_buy & (df_work['予測順位'] > prediction_rank_max).to_numpy(),
+            # 購入推奨がFalseで上記のどれにも該当しない場合は「複合条件」として記録
+            not_buy,
+        ],
+        np.arange(len(SKIP_REASONS), dtype=np.int8),
+        default=-1
+    ).astype(np.int8)
+    
+    df_work['スキップ理由'] = pd.Categorical.from_codes(skip_reason_codes, categories=SKIP_REASONS)
+    df_work['購入推奨'] = buy
+    total_recommended = int(buy.sum())
     
     logger.info(f"購入推奨馬数: {total_recommended}頭")
     
-    return df_integrated
+    return df_work
 
 
 def predict_sokuho_model(
@@ -157,7 +184,8 @@ def predict_sokuho_model(
     distance_max: int,
     kyoso_shubetsu_code: str,
     model_filename: str,
-    model_description: str
+    model_description: str,
+    conn=None
 ) -> pd.DataFrame:
     """
     単一モデルで速報データの予測を実行
@@ -170,6 +198,7 @@ def predict_sokuho_model(
         kyoso_shubetsu_code: 競走種別コード
         model_filename: モデルファイル名
         model_description: モデルの説明
+        conn: 再利用するDB接続（Noneの場合はこの関数内で接続・切断する）
         
     Returns:
         DataFrame: 予測結果
@@ -191,18 +220,28 @@ def predict_sokuho_model(
         kyoso_shubetsu_code=kyoso_shubetsu_code
     )
     
-    # データ取得
+    # データ取得（同じSQLは同一プロセス内で1回だけ実行し、結果を使い回す）
     try:
-        conn = psycopg2.connect(
-            dbname='keiba',
-            user='postgres',
-            password='ahtaht88',
-            host='localhost',
-            port=5432
-        )
-        df = pd.read_sql_query(sql, conn)
-        conn.close()
+        if sql in _RACE_DATA_CACHE:
+            logger.info("[INFO] 同じ条件の取得済みデータを再利用します")
+        elif conn is None:
+            own_conn = create_db_connection()
+            try:
+                _RACE_DATA_CACHE[sql] = pd.read_sql_query(sql, own_conn)
+            finally:
+                own_conn.close()
+        else:
+            _RACE_DATA_CACHE[sql] = pd.read_sql_query(sql, conn)
+        # 前処理・特徴量生成で列が追加されるため、キャッシュ本体ではなくコピーを使う
+        df = _RACE_DATA_CACHE[sql].copy()
     except Exception as e:
+        # 共有接続の場合、失敗したトランザクションを戻して次のモデルで使えるようにする
+        # （接続自体が切れているとrollbackも失敗するので、その場合は呼び出し側で再接続する）
+        if conn is not None:
+            try:
+                conn.rollback()
+            except psycopg2.Error as rollback_error:
+                logger.warning(f"[WARNING] DB接続のロールバックに失敗しました: {type(rollback_error).__name__}: {str(rollback_error)}")
         logger.error(f"[ERROR] データ取得エラー: {type(e).__name__}: {str(e)}")
         logger.error(f"[DEBUG] SQL実行エラーの詳細:")
         import traceback
@@ -220,32 +259,31 @@ def predict_sokuho_model(
     
     # 基本特徴量生成
     X = create_features(df)
-    logger.info(f"[DEBUG] 基本特徴量数: {len(X.columns)}個")
-    logger.info(f"[DEBUG] 基本特徴量: {list(X.columns)}")
+    logger.debug("基本特徴量数: %d個", len(X.columns))
+    logger.debug("基本特徴量: %s", list(X.columns))
     
     # 高度な特徴量生成（feature_engineering.pyの共通関数を使用）
     X = add_advanced_features(df, X, surface_type, distance_min, distance_max, logger=logger, inverse_rank=False)
-    logger.info(f"[DEBUG] 最終特徴量数: {len(X.columns)}個")
-    logger.info(f"[DEBUG] 最終特徴量: {list(X.columns)}")
+    logger.debug("最終特徴量数: %d個", len(X.columns))
+    logger.debug("最終特徴量: %s", list(X.columns))
+    
+    # 予測前に数値型を縮小（float64→float32）
+    X = downcast_features(X)
     
     # モデルロード
     try:
-        with open(model_path, 'rb') as model_file:
-            model = pickle.load(model_file)
+        model = load_model(model_path)
         
         # モデルが期待する特徴量数を確認
         if hasattr(model, 'n_features_'):
-            logger.info(f"[DEBUG] モデルが期待する特徴量数: {model.n_features_}個")
+            logger.debug("モデルが期待する特徴量数: %d個", model.n_features_)
     except Exception as e:
         logger.error(f"[ERROR] モデル読み込みエラー: {e}")
         return None
     
-    # 予測実行
-    def sigmoid(x):
-        return 1 / (1 + np.exp(-x))
-    
-    raw_scores = model.predict(X)
-    df['predicted_chakujun_score'] = sigmoid(raw_scores)
+    # 予測実行（シグモイド変換はscipyのufuncで1パス計算、スコアはfloat32で十分な精度）
+    raw_scores = np.asarray(model.predict(X), dtype=np.float32)
+    df['predicted_chakujun_score'] = expit(raw_scores)
     
     # データをソート
     df = df.sort_values(by=['kaisai_nen', 'kaisai_tsukihi', 'race_bango', 'umaban'], ascending=True)
@@ -291,9 +329,13 @@ def predict_sokuho_model(
         'predicted_chakujun_score': '予測スコア'
     })
     
-    # 整数に変換
-    output_df['人気順'] = output_df['人気順'].fillna(0).astype(int)
-    output_df['予測順位'] = output_df['予測順位'].fillna(0).astype(int)
+    # 型を縮小（順位は最大18なのでint8、繰り返しの多い文字列はカテゴリ型）
+    output_df = output_df.astype({
+        '競馬場': TRACK_NAME_DTYPE,
+        '芝ダ区分': SURFACE_NAME_DTYPE,
+    })
+    output_df['人気順'] = output_df['人気順'].fillna(0).astype(np.int8)
+    output_df['予測順位'] = output_df['予測順位'].fillna(0).astype(np.int8)
     
     # 購入推奨ロジックを追加
     output_df = add_sokuho_purchase_logic(output_df)
@@ -303,6 +345,73 @@ def predict_sokuho_model(
     return output_df
 
 
+def predict_sokuho_config(config: dict, conn=None):
+    """
+    モデル設定1件分の速報予測を実行（並列実行時はワーカープロセスで呼ばれる）
+    
+    Args:
+        config: モデル設定（model_config_loaderの1要素）
+        conn: 再利用するDB接続（Noneの場合は予測処理内で接続・切断する）
+        
+    Returns:
+        dict: {'model_name': モデル名, 'dataframe': 予測結果}、予測できなかった場合はNone
+    """
+    # モデルファイルの存在確認（universal_test.pyと同じ処理）
+    model_path = Path('models') / config['model_filename']
+    if not model_path.exists():
+        logger.warning(f"[SKIP] モデルファイルが見つかりません: {model_path}")
+        return None
+    
+    result = predict_sokuho_model(
+        track_code=config['track_code'],
+        surface_type=config['surface_type'],
+        distance_min=config['min_distance'],
+        distance_max=config['max_distance'],
+        kyoso_shubetsu_code=config.get('kyoso_shubetsu_code'),
+        model_filename=config['model_filename'],
+        model_description=config['description'],
+        conn=conn
+    )
+    
+    if result is None:
+        return None
+    
+    return {
+        'model_name': config['model_filename'].replace('.sav', ''),
+        'dataframe': result
+    }
+
+
+# 並列実行時のワーカープロセスごとのDB接続（_init_worker_connectionで作成し、そのワーカーの全モデルで使い回す）
+# ワーカープロセスの終了時に接続も閉じられる
+_WORKER_CONN = None
+
+
+def _init_worker_connection():
+    """
+    並列実行のワーカープロセス初期化処理（ワーカーごとにDB接続を1本作成）
+    
+    接続に失敗してもワーカーは起動させ、各モデルの予測時に再接続を試みる。
+    """
+    global _WORKER_CONN
+    _WORKER_CONN = ensure_db_connection()
+
+
+def _predict_sokuho_config_in_worker(config: dict):
+    """
+    ワーカープロセスでモデル設定1件分の速報予測を実行（ワーカーのDB接続を使い回す）
+    
+    Args:
+        config: モデル設定（model_config_loaderの1要素）
+        
+    Returns:
+        dict: predict_sokuho_configの戻り値
+    """
+    global _WORKER_CONN
+    _WORKER_CONN = ensure_db_connection(_WORKER_CONN)
+    return predict_sokuho_config(config, conn=_WORKER_CONN)
+
+
 def save_sokuho_results(df: pd.DataFrame, model_name: str, output_dir: str = 'sokuho_results'):
     """
     速報予測結果をTSVファイルに保存
@@ -328,6 +437,8 @@ def main():
     parser = argparse.ArgumentParser(description='速報データ予測スクリプト')
     parser.add_argument('--model', type=str, required=True,
                         help='モデルタイプ: "standard" または "custom"')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='並列実行するプロセス数（デフォルト: 1 = 逐次実行）')
     
     args = parser.parse_args()
     
@@ -351,33 +462,47 @@ def main():
         return
     
     # 各モデルで予測を実行
-    all_results = []
-    for i, config in enumerate(model_configs, 1):
-        logger.info(f"\n【{i}/{len(model_configs)}】 {config['description']} の処理中...")
-        
-        # モデルファイルの存在確認（universal_test.pyと同じ処理）
-        model_filename = config['model_filename']
-        model_path = Path('models') / model_filename
-        
-        if not model_path.exists():
-            logger.warning(f"[SKIP] モデルファイルが見つかりません: {model_path}")
-            continue
-        
-        result = predict_sokuho_model(
-            track_code=config['track_code'],
-            surface_type=config['surface_type'],
-            distance_min=config['min_distance'],
-            distance_max=config['max_distance'],
-            kyoso_shubetsu_code=config.get('kyoso_shubetsu_code'),
-            model_filename=config['model_filename'],
-            model_description=config['description']
-        )
+    if args.workers > 1:
+        # 並列実行（ワーカープロセスごとにDB接続を1本作成し、そのワーカーが担当する全モデルで使い回す）
+        # 取得済みデータのキャッシュもワーカーごとなので、同じSQLでも別ワーカーなら再取得になる
+        logger.info(f"[INFO] {args.workers}プロセスで並列実行します")
+        results = [None] * len(model_configs)
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker_connection) as executor:
+            futures = {
+                executor.submit(_predict_sokuho_config_in_worker, config): i
+                for i, config in enumerate(model_configs)
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    logger.error(f"[ERROR] {model_configs[i]['description']} の予測に失敗しました: {type(e).__name__}: {str(e)}")
+                    continue
+                # 完了した順に進捗を表示（ワーカー側のログは並列で混ざるため、どのモデルが終わったかをここで出す）
+                status = "処理が完了しました" if results[i] is not None else "処理が完了しました（予測結果なし）"
+                logger.info(f"【{done}/{len(model_configs)}】 {model_configs[i]['description']} の{status}")
+    else:
+        # 逐次実行（DB接続は全モデルで1本を使い回す）
+        try:
+            conn = create_db_connection()
+        except Exception as e:
+            logger.error(f"[ERROR] DB接続エラー: {type(e).__name__}: {str(e)}")
+            return
         
-        if result is not None:
-            all_results.append({
-                'model_name': config['model_filename'].replace('.sav', ''),
-                'dataframe': result
-            })
+        results = []
+        try:
+            for i, config in enumerate(model_configs, 1):
+                logger.info(f"\n【{i}/{len(model_configs)}】 {config['description']} の処理中...")
+                # 途中で接続が切れていたら張り直す（再接続できなければこのモデルは内部で接続を試みる）
+                conn = ensure_db_connection(conn)
+                results.append(predict_sokuho_config(config, conn=conn))
+        finally:
+            if conn is not None:
+                conn.close()
+    
+    # 結果はモデル設定の順に並べる
+    all_results = [result for result in results if result is not None]
     
     # 結果の保存
     if len(all_results) == 0:
@@ -390,25 +515,26 @@ def main():
         for result in all_results:
             save_sokuho_results(result['dataframe'], result['model_name'])
         
-        # 全モデルの結果を統合して保存（universal_test.pyと同じパターン）
-        all_dfs = [result['dataframe'] for result in all_results]
-        if len(all_dfs) > 0:
-            df_all = pd.concat(all_dfs, ignore_index=True)
-            
-            # 集約ファイルでは不要な列を削除
-            columns_to_drop = ['スコア差', 'スキップ理由', '購入推奨']
-            df_all_clean = df_all.drop(columns=[col for col in columns_to_drop if col in df_all.columns])
-            
-            # 統合ファイルを保存
-            output_path = Path('sokuho_results')
-            output_path.mkdir(exist_ok=True)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            all_filename = f'sokuho_prediction_all_{timestamp}.tsv'
-            filepath_all = output_path / all_filename
-            
-            df_all_clean.to_csv(filepath_all, index=False, sep='\t', encoding='utf-8-sig')
-            logger.info(f"[SAVE] 全レース統合ファイルを保存しました: {filepath_all}")
-            logger.info(f"       統合レース数: {len(df_all_clean)}件")
+        # 全モデルの結果を統合して保存
+        # concatで全結果を複製せず、1つのファイルにモデルごとに追記していく
+        output_path = Path('sokuho_results')
+        output_path.mkdir(exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        all_filename = f'sokuho_prediction_all_{timestamp}.tsv'
+        filepath_all = output_path / all_filename
+        
+        # 集約ファイルでは不要な列
+        columns_to_drop = ['スコア差', 'スキップ理由', '購入推奨']
+        
+        total_rows = 0
+        with open(filepath_all, 'w', encoding='utf-8-sig', newline='') as aggfile:
+            for i, result in enumerate(all_results):
+                df_clean = result['dataframe'].drop(columns=columns_to_drop, errors='ignore')
+                df_clean.to_csv(aggfile, index=False, sep='\t', header=(i == 0))
+                total_rows += len(df_clean)
+        
+        logger.info(f"[SAVE] 全レース統合ファイルを保存しました: {filepath_all}")
+        logger.info(f"       統合レース数: {total_rows}件")
         
         logger.info("\n速報予測が完了しました！")
 
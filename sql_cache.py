@@ -0,0 +1,88 @@
+"""
+SQL結果キャッシュの共通化モジュール
+
+test.pyやuniversal_test.py（test_3years_clean.py経由）でモデルや買い目ルールを
+試行錯誤するたびに、同じ重いSQLをPostgreSQLへ投げ直さなくて済むようにします。
+
+環境変数 KEIBA_SQL_CACHE=1 を指定したときだけ有効になり、
+SQL文字列のハッシュをキーにして取得結果を .cache/sql/ 以下にparquetで保存します。
+2回目以降は同じSQLならDBに接続せずparquetから読み込みます。
+（DBのデータを更新したときは .cache/sql/ を削除してください）
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+import pandas as pd
+
+# キャッシュの保存先
+SQL_CACHE_DIR = Path('.cache') / 'sql'
+
+
+def is_sql_cache_enabled():
+    """
+    SQL結果キャッシュが有効か（環境変数 KEIBA_SQL_CACHE=1 のときだけ有効）
+
+    Returns:
+        bool: 有効ならTrue
+    """
+    return os.environ.get('KEIBA_SQL_CACHE') == '1'
+
+
+def get_sql_cache_path(sql):
+    """
+    SQLに対応するキャッシュファイルのパスを返す
+
+    Args:
+        sql (str): 実行するSQL
+
+    Returns:
+        Path: キャッシュファイルのパス（.cache/sql/<SQLのSHA1>.parquet）
+    """
+    key = hashlib.sha1(sql.encode('utf-8')).hexdigest()
+    return SQL_CACHE_DIR / f"{key}.parquet"
+
+
+def read_sql_cached(sql, conn=None, connect=None):
+    """
+    SQLを実行してDataFrameを返す（キャッシュ有効時はparquetから読み込み）
+
+    キャッシュが無効、またはキャッシュファイルがない場合はDBから取得する。
+    connを渡した場合はそれを使い（閉じない）、渡さない場合はconnect()で接続して取得後に閉じる。
+    キャッシュヒット時はconnect()を呼ばないので、DBに接続せずに済む。
+
+    Args:
+        sql (str): 実行するSQL
+        conn: 既存のDBコネクション（省略時はconnectで接続）
+        connect (callable): DBコネクションを返す関数（connを渡さない場合に必須）
+
+    Returns:
+        pd.DataFrame: 取得結果
+    """
+    use_cache = is_sql_cache_enabled()
+    cache_path = get_sql_cache_path(sql) if use_cache else None
+
+    if use_cache and cache_path.exists():
+        print(f"[CACHE] SQL結果をキャッシュから読み込み: {cache_path}")
+        return pd.read_parquet(cache_path)
+
+    if conn is not None:
+        df = pd.read_sql_query(sql=sql, con=conn)
+    else:
+        own_conn = connect()
+        try:
+            df = pd.read_sql_query(sql=sql, con=own_conn)
+        finally:
+            own_conn.close()
+
+    if use_cache:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            df.to_parquet(cache_path, compression='zstd')
+            print(f"[SAVE] SQL結果をキャッシュに保存: {cache_path}")
+        except ImportError as e:
+            # parquetの書き込みにはpyarrowが必要（なければキャッシュせずに続行）
+            print(f"[WARNING] SQL結果をキャッシュできませんでした（pyarrowが必要です）: {e}")
+
+    return df
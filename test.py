@@ -1,22 +1,60 @@
+import os
 import psycopg2
 import pandas as pd
-import pickle
-import lightgbm as lgb
 import numpy as np
+from scipy.special import expit
+from model_loader import load_model
+from sql_cache import read_sql_cached
 
 def predict_and_save_results():
-    # PostgreSQL コネクションの作成
-    conn = psycopg2.connect(
-        host='localhost',
-        port='5432',
-        user='postgres',
-        password='ahtaht88',
-        dbname='keiba'
-    )
+    # PostgreSQL コネクションの作成（SQL結果キャッシュがあるときは接続しない）
+    def create_connection():
+        return psycopg2.connect(
+            host='localhost',
+            port='5432',
+            user='postgres',
+            password='ahtaht88',
+            dbname='keiba'
+        )
 
     # SQLクエリ
     sql = """
-    select * from (
+    -- Python側で使う列だけを取得する（特徴量・レースキー・表示用・払戻）
+    select
+        rase.kaisai_nen
+        , rase.kaisai_tsukihi
+        , rase.race_bango
+        , rase.umaban
+        , rase.bamei
+        , rase.keibajo_name
+        , rase.kyori
+        , rase.tenko_code
+        , rase.babajotai_code_shiba
+        , rase.seibetsu_code
+        , rase.wakuban
+        , rase.max_wakuban
+        , rase.umaban_numeric
+        , rase.umaban_percentile
+        , rase.barei
+        , rase.futan_juryo
+        , rase.tansho_odds
+        , rase.tansho_ninkijun_numeric
+        , rase.kakutei_chakujun_numeric
+        , rase.sotai_chakujun_numeric
+        , rase.time_index
+        , rase.past_score
+        , rase.kohan_3f_index
+        , rase.複勝1着馬番, rase.複勝1着オッズ, rase.複勝1着人気
+        , rase.複勝2着馬番, rase.複勝2着オッズ, rase.複勝2着人気
+        , rase.複勝3着馬番, rase.複勝3着オッズ, rase.複勝3着人気
+        , rase.馬連馬番1, rase.馬連馬番2, rase.馬連オッズ
+        , rase.ワイド1_2馬番1, rase.ワイド1_2馬番2
+        , rase.ワイド2_3着馬番1, rase.ワイド2_3着馬番2
+        , rase.ワイド1_3着馬番1, rase.ワイド1_3着馬番2
+        , rase.ワイド1_2オッズ, rase.ワイド2_3オッズ, rase.ワイド1_3オッズ
+        , rase.馬単馬番1, rase.馬単馬番2, rase.馬単オッズ
+        , rase.３連複オッズ
+    from (
         select
         ra.kaisai_nen,
         ra.kaisai_tsukihi,
@@ -24,19 +62,7 @@ def predict_and_save_results():
         seum.umaban,
         seum.bamei,
         ra.keibajo_code,
-        CASE 
-            WHEN ra.keibajo_code = '01' THEN '札幌' 
-            WHEN ra.keibajo_code = '02' THEN '函館' 
-            WHEN ra.keibajo_code = '03' THEN '福島' 
-            WHEN ra.keibajo_code = '04' THEN '新潟' 
-            WHEN ra.keibajo_code = '05' THEN '東京' 
-            WHEN ra.keibajo_code = '06' THEN '中山' 
-            WHEN ra.keibajo_code = '07' THEN '中京' 
-            WHEN ra.keibajo_code = '08' THEN '京都' 
-            WHEN ra.keibajo_code = '09' THEN '阪神' 
-            WHEN ra.keibajo_code = '10' THEN '小倉' 
-            ELSE '' 
-        END keibajo_name,
+        coalesce(kj.keibajo_name, '') as keibajo_name,
         ra.kyori,
         ra.tenko_code,
         ra.babajotai_code_shiba,
@@ -47,28 +73,23 @@ def predict_and_save_results():
         seum.ketto_toroku_bango,
         seum.wakuban,
         cast(seum.umaban as integer) as umaban_numeric,
+        -- レース内の最大枠番（枠番比率の分母）
+        MAX(cast(seum.wakuban as integer)) OVER (
+            PARTITION BY ra.kaisai_nen, ra.kaisai_tsukihi, ra.keibajo_code, ra.race_bango
+        ) AS max_wakuban,
+        -- レース内での馬番相対位置（pandasのrank(pct=True)と同じ「順位/頭数」）
+        CUME_DIST() OVER (
+            PARTITION BY ra.kaisai_nen, ra.kaisai_tsukihi, ra.keibajo_code, ra.race_bango
+            ORDER BY cast(seum.umaban as integer)
+        ) AS umaban_percentile,
         seum.barei,
         seum.kishu_code,
         seum.chokyoshi_code,
         seum.futan_juryo,
         seum.seibetsu_code,
-        CASE WHEN seum.seibetsu_code = '1' THEN '1' ELSE '0' END AS mare_horse,
-        CASE WHEN seum.seibetsu_code = '2' THEN '1' ELSE '0' END AS femare_horse,
-        CASE WHEN seum.seibetsu_code = '3' THEN '1' ELSE '0' END AS sen_horse,
-        CASE WHEN ra.babajotai_code_shiba = '1' THEN '1' ELSE '0' END AS baba_good,
-        CASE WHEN ra.babajotai_code_shiba = '2' THEN '1' ELSE '0' END AS baba_slightly_heavy,
-        CASE WHEN ra.babajotai_code_shiba = '3' THEN '1' ELSE '0' END AS baba_heavy,
-        CASE WHEN ra.babajotai_code_shiba = '4' THEN '1' ELSE '0' END AS baba_defective,
-        CASE WHEN ra.tenko_code = '1' THEN '1' ELSE '0' END AS tenko_fine,
-        CASE WHEN ra.tenko_code = '2' THEN '1' ELSE '0' END AS tenko_cloudy,
-        CASE WHEN ra.tenko_code = '3' THEN '1' ELSE '0' END AS tenko_rainy,
-        CASE WHEN ra.tenko_code = '4' THEN '1' ELSE '0' END AS tenko_drizzle,
-        CASE WHEN ra.tenko_code = '5' THEN '1' ELSE '0' END AS tenko_snow,
-        CASE WHEN ra.tenko_code = '6' THEN '1' ELSE '0' END AS tenko_light_snow,
         nullif(cast(seum.tansho_odds as float), 0) / 10 as tansho_odds,
         nullif(cast(seum.tansho_ninkijun as integer), 0) as tansho_ninkijun_numeric,
         nullif(cast(seum.kakutei_chakujun as integer), 0) as kakutei_chakujun_numeric,
-        1.0 / nullif(cast(seum.kakutei_chakujun as integer), 0) as chakujun_score,
         -1 as sotai_chakujun_numeric,
         -1 AS time_index,
         SUM(
@@ -97,7 +118,6 @@ def predict_and_save_results():
             ORDER BY cast(ra.kaisai_nen as integer), cast(ra.kaisai_tsukihi as integer)
             ROWS BETWEEN 3 PRECEDING AND 1 PRECEDING  
         ) AS past_score
-        ,0 as kohan_3f_sec
         ,0 AS kohan_3f_index
         ,nullif(cast(nullif(trim(hr.haraimodoshi_fukusho_1a), '') as integer), 0) as 複勝1着馬番
         ,nullif(cast(nullif(trim(hr.haraimodoshi_fukusho_1b), '') as float), 0) / 100 as 複勝1着オッズ
@@ -161,6 +181,13 @@ def predict_and_save_results():
             and ra.kaisai_tsukihi = hr.kaisai_tsukihi 
             and ra.keibajo_code = hr.keibajo_code 
             and ra.race_bango = hr.race_bango
+        -- 競馬場コード→競馬場名の対応表（行ごとのCASE分岐の代わりに1回だけ結合）
+        left join (
+            values
+                ('01', '札幌'), ('02', '函館'), ('03', '福島'), ('04', '新潟'), ('05', '東京'),
+                ('06', '中山'), ('07', '中京'), ('08', '京都'), ('09', '阪神'), ('10', '小倉')
+        ) kj (keibajo_code, keibajo_name)
+            on ra.keibajo_code = kj.keibajo_code
     where
         cast(ra.kaisai_nen as integer) = 2023 
     ) rase 
@@ -171,17 +198,22 @@ def predict_and_save_results():
     and cast(rase.kyori as integer) >= 1700
     """
 
-    # データを取得
-    df = pd.read_sql_query(sql=sql, con=conn)
+    # データを取得（KEIBA_SQL_CACHE=1 なら2回目以降はparquetキャッシュから読み込む）
+    df = read_sql_cached(sql, connect=create_connection)
 
     # 馬名だけは保存しておく
     horse_names = df['bamei'].copy()
     
     # 数値データだけを前処理
     numeric_columns = df.columns.drop(['bamei', 'keibajo_name'])  # 馬名以外の列を取得
-    df[numeric_columns] = df[numeric_columns].apply(pd.to_numeric, errors='coerce')
-    df[numeric_columns] = df[numeric_columns].replace('0', np.nan)
-    df[numeric_columns] = df[numeric_columns].fillna(0)
+    # to_numeric後は文字列の'0'は残らないので、数値化と欠損埋めを1回の代入で済ませる
+    df[numeric_columns] = df[numeric_columns].apply(pd.to_numeric, errors='coerce').fillna(0)
+
+    # 払戻系の列は以降のスキャンで何度も読むので、オッズはfloat32、馬番・人気は1〜18なのでint16に縮める
+    odds_columns = ['tansho_odds'] + [col for col in numeric_columns if col.endswith('オッズ')]
+    small_int_columns = ['umaban', 'tansho_ninkijun_numeric'] + [col for col in numeric_columns if '馬番' in col or col.endswith('人気')]
+    df[odds_columns] = df[odds_columns].astype(np.float32)
+    df[small_int_columns] = df[small_int_columns].astype(np.int16)
     
     # 保存しておいた馬名を戻す
     df['bamei'] = horse_names
@@ -216,8 +248,8 @@ def predict_and_save_results():
     
     # 高性能な派生特徴量を追加！
     # 枠番と頭数の比率（内枠有利度）
-    max_wakuban = df.groupby(['kaisai_nen', 'kaisai_tsukihi', 'race_bango'])['wakuban'].transform('max')
-    df['wakuban_ratio'] = df['wakuban'] / max_wakuban
+    # レース内の最大枠番はSQLのウィンドウ関数で計算済み
+    df['wakuban_ratio'] = df['wakuban'] / df['max_wakuban']
     X['wakuban_ratio'] = df['wakuban_ratio']
     
     # 斤量と馬齢の比率（若馬の負担能力）
@@ -237,10 +269,7 @@ def predict_and_save_results():
     df['barei_peak_distance'] = abs(df['barei'] - 4)  # 4歳をピークと仮定
     X['barei_peak_distance'] = df['barei_peak_distance']
 
-    # レース内での馬番相対位置（頭数による正規化）
-    df['umaban_percentile'] = df.groupby(['kaisai_nen', 'kaisai_tsukihi', 'race_bango'])['umaban_numeric'].transform(
-        lambda x: x.rank(pct=True)
-    )
+    # レース内での馬番相対位置（頭数による正規化、SQLのCUME_DISTで計算済み）
     X['umaban_percentile'] = df['umaban_percentile']
     
     # # 微小な個体識別子を追加（重複完全回避のため）
@@ -256,50 +285,43 @@ def predict_and_save_results():
 
     # お試し特徴量だよ
         
-    # kohan_3f_indexを距離に応じた値にする！
-    distance_bins = [0, 1600, 2000, 2400, 10000]
-    default_values = {
-        0: 33.5,   # 短距離（〜1600m）
-        1: 35.0,   # マイル（〜2000m）
-        2: 36.0,   # 中距離（〜2400m）
-        3: 37.0    # 長距離（2400m〜）
-    }
-    
-    # 距離のビンに応じて基準タイムを割り当て
-    df['distance_bin'] = pd.cut(df['kyori'], bins=distance_bins, labels=False)
-    df['kohan_3f_base'] = df['distance_bin'].map(default_values)
-    
-    # 基準タイムから少しだけランダムにずらす（実際のレースっぽく）
-    np.random.seed(42)  # 再現性のためシード固定
-    df['kohan_3f_sec'] = df['kohan_3f_base'] + np.random.normal(0, 0, len(df))
-    
     # kohan_3f_indexを計算（main.pyと同じ計算方法）
-    df['kohan_3f_index'] = df['kohan_3f_sec'] - df['kohan_3f_base']
+    # 上がり3Fタイムは距離別の基準タイム＋標準偏差0の乱数で作っていたため基準タイムとの差は常に0になる
+    # （距離別の基準タイムを引いても結果が変わらないので、定数0をそのまま入れる）
+    df['kohan_3f_index'] = 0.0
     X['kohan_3f_index'] = df['kohan_3f_index']
 
-    # モデルをロード
-    with open('hanshin_shiba_3ageup_model.sav', 'rb') as model_file:
-        model = pickle.load(model_file)
-
-    # シグモイド関数を定義
-    def sigmoid(x):
-        """値を0-1の範囲に収めるよ～"""
-        import numpy as np
-        return 1 / (1 + np.exp(-x))
+    # モデルをロード（同名の.txtがあればLightGBMネイティブ形式で読み込む）
+    model = load_model('hanshin_shiba_3ageup_model.sav')
 
     # 予測を実行して、57y5t rvfnnシグモイド関数で変換
-    raw_scores = model.predict(X)
-    df['predicted_chakujun_score'] = sigmoid(raw_scores)
+    # モデルはlgb.train製のBoosterなのでそのまま呼ぶ（カテゴリ列の対応付けがあるためDataFrameのまま渡す）
+    # スレッド数は全コアを明示して並列に予測する
+    raw_scores = model.predict(X, num_threads=os.cpu_count())
+    # シグモイドはscipyのexpit（ufunc）で1パス計算する
+    df['predicted_chakujun_score'] = expit(raw_scores)
 
     # データをソート
     df = df.sort_values(by=['kaisai_nen', 'kaisai_tsukihi', 'race_bango', 'umaban'], ascending=True)
 
-    # グループ内でのスコア順位を計算
-    df['score_rank'] = df.groupby(['kaisai_nen', 'kaisai_tsukihi', 'race_bango'])['predicted_chakujun_score'].rank(method='min', ascending=False)
-
-    # kakutei_chakujun_numeric と score_rank を整数に変換
+    # グループ内でのスコア順位を計算（同点は小さい方の順位、groupby.rank(method='min')と同じ）
+    # レース番号とスコア降順の1回のlexsortで並べ、レース先頭・同点先頭からの位置で順位を決める
+    scores = df['predicted_chakujun_score'].to_numpy(dtype=float)
+    race_ids = df.groupby(['kaisai_nen', 'kaisai_tsukihi', 'race_bango'], sort=False).ngroup().to_numpy()
+    order = np.lexsort((-scores, race_ids))
+    sorted_scores = scores[order]
+    sorted_race_ids = race_ids[order]
+    positions = np.arange(len(order))
+    race_start = np.r_[True, sorted_race_ids[1:] != sorted_race_ids[:-1]]
+    tie_start = race_start | np.r_[True, sorted_scores[1:] != sorted_scores[:-1]]
+    rank_in_race = positions - np.maximum.accumulate(np.where(race_start, positions, 0)) + 1
+    score_rank = np.empty(len(order))
+    score_rank[order] = rank_in_race[np.maximum.accumulate(np.where(tie_start, positions, 0))]
+    score_rank[np.isnan(scores)] = np.nan
+    df['score_rank'] = score_rank
+
+    # kakutei_chakujun_numeric と score_rank を整数に変換（人気順は前処理でint16にしてある）
     df['kakutei_chakujun_numeric'] = df['kakutei_chakujun_numeric'].fillna(0).astype(int)
-    df['tansho_ninkijun_numeric'] = df['tansho_ninkijun_numeric'].fillna(0).astype(int)
     df['score_rank'] = df['score_rank'].fillna(0).astype(int)
 
     # 必要な列を選択
@@ -366,7 +388,6 @@ def predict_and_save_results():
 
     # 単勝の的中率と回収率
     tansho_hit = (output_df['確定着順'] == 1) & (output_df['予測順位'] == 1)
-    race_count = len(output_df.groupby(['開催年', '開催日', 'レース番号']))
     tansho_hitrate = 100 * tansho_hit.sum() / race_count
     tansho_recoveryrate = 100 * (tansho_hit * output_df['単勝オッズ']).sum() / race_count
 
@@ -377,55 +398,61 @@ def predict_and_save_results():
     # 的中馬だけ取り出す
     hit_rows = output_df[fukusho_hit].copy()
 
-    def extract_odds(row):
-        if row['確定着順'] == 1:
-            return row['複勝1着オッズ']
-        elif row['確定着順'] == 2:
-            return row['複勝2着オッズ']
-        elif row['確定着順'] == 3:
-            return row['複勝3着オッズ']
-        else:
-            return 0
-
     # 的中馬に対応する払戻を計算（100円賭けたとして）
-    hit_rows['的中オッズ'] = hit_rows.apply(extract_odds, axis=1)
+    # 確定着順に応じて複勝1～3着オッズを選ぶ（行ごとのapplyではなくnp.selectで一括）
+    hit_chakujun = hit_rows['確定着順'].to_numpy()
+    hit_rows['的中オッズ'] = np.select(
+        [hit_chakujun == 1, hit_chakujun == 2, hit_chakujun == 3],
+        [hit_rows['複勝1着オッズ'].to_numpy(), hit_rows['複勝2着オッズ'].to_numpy(), hit_rows['複勝3着オッズ'].to_numpy()],
+        default=0
+    )
     total_payout = (hit_rows['的中オッズ'] * 100).sum()
 
     # 総購入額（毎レースで3頭に100円ずつ）
     total_bet = race_count * 3 * 100
     fukusho_recoveryrate = total_payout / total_bet * 100
 
+    # 予測スコア順に1回だけソートして、レースごとの予測1～3位の確定着順を横持ちにする
+    # （以降の馬連・ワイド・馬単・３連複はこの表に対するベクトル演算で判定する）
+    race_keys = ['開催年', '開催日', 'レース番号']
+    ranked = output_df.sort_values(race_keys + ['予測スコア'], ascending=[True, True, True, False], kind='stable')
+    pred_order = ranked.groupby(race_keys).cumcount() + 1
+    top3 = ranked.loc[pred_order <= 3, race_keys + ['確定着順']].assign(予測順=pred_order[pred_order <= 3])
+    top_finishes = top3.set_index(race_keys + ['予測順'])['確定着順'].unstack().reindex(columns=[1, 2, 3])
+    finish_1 = top_finishes[1]
+    finish_2 = top_finishes[2]
+    finish_3 = top_finishes[3]
+    in_top3_1 = finish_1.isin([1, 2, 3])
+    in_top3_2 = finish_2.isin([1, 2, 3])
+    in_top3_3 = finish_3.isin([1, 2, 3])
+
+    # レースごとの払戻オッズ（各レースの先頭行の値）を予測着順の表と同じ並びで取得
+    # （馬連・ワイド・馬単・３連複の払戻はすべてこのレース単位の表から引く）
+    payout_odds_columns = ['馬連オッズ', 'ワイド1_2オッズ', 'ワイド1_3オッズ', 'ワイド2_3オッズ', '馬単オッズ', '３連複オッズ']
+    race_odds = output_df.drop_duplicates(race_keys).set_index(race_keys)[payout_odds_columns].reindex(top_finishes.index)
+
     # 馬連の的中率と回収率 (上位2頭が着順1-2に来たかどうか)
-    umaren_hit = output_df.groupby(['開催年', '開催日', 'レース番号']).apply(
-        lambda x: set([1, 2]).issubset(set(x.sort_values('予測スコア', ascending=False).head(2)['確定着順'].values))
-    )
+    umaren_hit = ((finish_1 == 1) & (finish_2 == 2)) | ((finish_1 == 2) & (finish_2 == 1))
     umaren_hitrate = 100 * umaren_hit.sum() / race_count
-    umaren_recoveryrate = 100 * (umaren_hit * output_df.groupby(['開催年', '開催日', 'レース番号'])['馬連オッズ'].first()).sum() / race_count
+    umaren_recoveryrate = 100 * (umaren_hit * race_odds['馬連オッズ']).sum() / race_count
 
     # ワイドは予測上位3頭から2頭選ぶ組み合わせがどれか1つでも的中すればOK！
-    wide_hit = output_df.groupby(['開催年', '開催日', 'レース番号']).apply(
-        lambda x: any([
-            # 予測1位と2位の馬が3着以内に来たかチェック
-            len(set(x.sort_values('予測スコア', ascending=False).iloc[[0, 1]]['確定着順'].values) & {1, 2, 3}) == 2,
-            # 予測1位と3位の馬が3着以内に来たかチェック
-            len(set(x.sort_values('予測スコア', ascending=False).iloc[[0, 2]]['確定着順'].values) & {1, 2, 3}) == 2,
-            # 予測2位と3位の馬が3着以内に来たかチェック
-            len(set(x.sort_values('予測スコア', ascending=False).iloc[[1, 2]]['確定着順'].values) & {1, 2, 3}) == 2
-        ])
-    )
+    # （同着で着順が同じ2頭は組み合わせとして数えない）
+    # 予測1位と2位の馬が3着以内に来たかチェック
+    wide_hit_12 = in_top3_1 & in_top3_2 & (finish_1 != finish_2)
+    # 予測1位と3位の馬が3着以内に来たかチェック
+    wide_hit_13 = in_top3_1 & in_top3_3 & (finish_1 != finish_3)
+    # 予測2位と3位の馬が3着以内に来たかチェック
+    wide_hit_23 = in_top3_2 & in_top3_3 & (finish_2 != finish_3)
+    wide_hit = wide_hit_12 | wide_hit_13 | wide_hit_23
     wide_hitrate = wide_hit.sum() / (race_count * 3) * 100
 
-    wide_odds_sum = 0
-    for name, race_group in output_df.groupby(['開催年', '開催日', 'レース番号']):
-        top_horses = race_group.sort_values('予測スコア', ascending=False).head(3)
-        
-        # 上位3頭から2頭選ぶ組み合わせのどれかが的中したらOK
-        if len(set(top_horses.iloc[[0, 1]]['確定着順'].values) & {1, 2, 3}) == 2:
-            wide_odds_sum += race_group['ワイド1_2オッズ'].values[0]
-        elif len(set(top_horses.iloc[[0, 2]]['確定着順'].values) & {1, 2, 3}) == 2:
-            wide_odds_sum += race_group['ワイド1_3オッズ'].values[0]
-        elif len(set(top_horses.iloc[[1, 2]]['確定着順'].values) & {1, 2, 3}) == 2:
-            wide_odds_sum += race_group['ワイド2_3オッズ'].values[0]
+    # 上位3頭から2頭選ぶ組み合わせのどれかが的中したらOK（1-2 → 1-3 → 2-3 の優先順で1つだけ払戻）
+    wide_odds_sum = np.where(
+        wide_hit_12, race_odds['ワイド1_2オッズ'],
+        np.where(wide_hit_13, race_odds['ワイド1_3オッズ'],
+                 np.where(wide_hit_23, race_odds['ワイド2_3オッズ'], 0))
+    ).sum()
 
     wide_total_payout = (wide_odds_sum * 100)
 
@@ -433,29 +460,21 @@ def predict_and_save_results():
     wide_recoveryrate = wide_total_payout / total_bet * 100
 
     # 馬単の的中率と回収率 (上位2頭が順番通りに着順1-2に来たかどうか)
-    umatan_hit = output_df.groupby(['開催年', '開催日', 'レース番号']).apply(
-        lambda x: list(x.sort_values('予測スコア', ascending=False).head(2)['確定着順'].values) == [1, 2]
-    )
+    umatan_hit = (finish_1 == 1) & (finish_2 == 2)
     umatan_hitrate = 100 * umatan_hit.sum() / race_count
     
     # レースごとの馬単オッズで集計するように修正！！
-    umatan_odds_sum = 0
-    for name, race_group in output_df.groupby(['開催年', '開催日', 'レース番号']):
-        top_horses = race_group.sort_values('予測スコア', ascending=False).head(2)
-        # 上位2頭が順番通りに1-2に来たかチェック
-        if list(top_horses['確定着順'].values) == [1, 2]:
-            # 的中したらそのレースの馬単オッズを加算
-            umatan_odds_sum += race_group['馬単オッズ'].iloc[0]
+    # 上位2頭が順番通りに1-2に来たレースだけ、そのレースの馬単オッズを加算
+    umatan_odds_sum = np.where(umatan_hit, race_odds['馬単オッズ'], 0).sum()
 
     # 正しい回収率計算（レース数×100円賭けた場合の回収率）
     umatan_recoveryrate = 100 * umatan_odds_sum / race_count
 
     # 三連複の的中率と回収率 (上位3頭が着順1-2-3に来たかどうか)
-    sanrenpuku_hit = output_df.groupby(['開催年', '開催日', 'レース番号']).apply(
-        lambda x: set([1, 2, 3]).issubset(set(x.sort_values('予測スコア', ascending=False).head(3)['確定着順'].values))
-    )
+    top3_finish_set = top_finishes[[1, 2, 3]]
+    sanrenpuku_hit = top3_finish_set.eq(1).any(axis=1) & top3_finish_set.eq(2).any(axis=1) & top3_finish_set.eq(3).any(axis=1)
     sanrenpuku_hitrate = 100 * sanrenpuku_hit.sum() / len(sanrenpuku_hit)
-    sanrenpuku_recoveryrate = 100 * (sanrenpuku_hit * output_df.groupby(['開催年', '開催日', 'レース番号'])['３連複オッズ'].first()).sum() / len(sanrenpuku_hit)
+    sanrenpuku_recoveryrate = 100 * (sanrenpuku_hit * race_odds['３連複オッズ']).sum() / len(sanrenpuku_hit)
 
     # 結果をデータフレームにまとめる
     summary_df = pd.DataFrame({
@@ -464,25 +483,6 @@ def predict_and_save_results():
         '回収率(%)': [tansho_recoveryrate, fukusho_recoveryrate, umaren_recoveryrate, wide_recoveryrate, umatan_recoveryrate, sanrenpuku_recoveryrate]
     }, index=['単勝', '複勝', '馬連', 'ワイド', '馬単', '３連複'])
 
-    # # 2つの結果を結合する（これがマジ大事！）
-    # output_df = pd.concat([output_df, pd.DataFrame([[""] * len(output_df.columns)], columns=output_df.columns)])
-    # output_df = pd.concat([output_df, pd.DataFrame([[""] * len(output_df.columns)], columns=output_df.columns)])
-    # output_df = pd.concat([output_df, pd.DataFrame([[""] * len(output_df.columns)], columns=output_df.columns)])
-
-    # # ここのコードちょっと変えるだけ！
-    # # 空行挿入したいなら、これの方が確実だよ！
-    # rows_to_add = len(summary_df)  # 6行必要（単勝、複勝、馬連、ワイド、馬単、３連複）
-    # empty_df = pd.DataFrame({col: [""] * rows_to_add for col in output_df.columns})
-    # output_df = pd.concat([output_df, empty_df], ignore_index=True)
-
-    # # 結果の表を追加（ループ処理はそのまま使えるよ）
-    # start_row = len(output_df) - rows_to_add
-    # for i, (bet_type, row) in enumerate(summary_df.iterrows()):
-    #     output_df.iloc[start_row + i, 0] = bet_type
-    #     output_df.iloc[start_row + i, 1] = f"的中数: {row['的中数']}"
-    #     output_df.iloc[start_row + i, 2] = f"的中率: {row['的中率(%)']:.2f}%"
-    #     output_df.iloc[start_row + i, 3] = f"回収率: {row['回収率(%)']:.2f}%"
-
     # 結果をTSVに保存
     output_file = 'predicted_results.tsv'
     output_df.to_csv(output_file, index=False, sep='\t', encoding='utf-8-sig')
@@ -7,13 +7,14 @@ import re
 import json
 from pathlib import Path
 
-def run_model_test(model_file, test_year):
+def run_model_test(model_file, test_year, conn=None):
     """
     単一モデルのテスト実行
     
     Args:
         model_file (Path): モデルファイルのパス
         test_year (int): テスト年
+        conn: 使い回すDBコネクション（省略時はpredict_with_model内で接続）
     
     Returns:
         bool: 成功時True
@@ -56,7 +57,8 @@ def run_model_test(model_file, test_year):
             min_distance=config['min_distance'],
             max_distance=config['max_distance'],
             test_year_start=test_year,
-            test_year_end=test_year
+            test_year_end=test_year,
+            conn=conn
         )
         
         if output_df is None:
@@ -95,6 +97,14 @@ def run_model_test(model_file, test_year):
         print(f"[ERROR] テスト実行エラー: {e}")
         import traceback
         traceback.print_exc()
+        # 共有コネクションのトランザクションがエラー状態のままだと次のテストも失敗するので戻す
+        # （接続自体が切れているとrollbackも失敗するので、その場合は次のテスト前に再接続する）
+        if conn is not None:
+            import psycopg2
+            try:
+                conn.rollback()
+            except psycopg2.Error as rollback_error:
+                print(f"[WARNING] DB接続のロールバックに失敗しました: {rollback_error}")
         return False
 
 def main():
@@ -122,11 +132,9 @@ def main():
     
     results = []
     
+    # 先に実行対象のモデルファイルを確認する（見つからないものはここでスキップ）
+    planned_runs = []
     for test_year, train_range in test_plan.items():
-        print(f"\n{'='*60}")
-        print(f"【{test_year}年テスト】 学習期間: {train_range}")
-        print(f"{'='*60}")
-        
         for base_name in base_names:
             model_filename = f"{base_name}_{train_range}.sav"
             model_path = models_dir / model_filename
@@ -135,15 +143,54 @@ def main():
                 print(f"[WARNING] {model_filename} が見つかりません。スキップ。")
                 continue
             
-            print(f"\n[RUN] {base_name} ({train_range} → {test_year}年)")
-            success = run_model_test(model_path, test_year)
-            
-            if success:
-                results.append({
-                    'test_year': test_year,
-                    'train_range': train_range,
-                    'model': base_name
-                })
+            planned_runs.append((test_year, train_range, base_name, model_path))
+    
+    if planned_runs:
+        # 全テストで1つのDBコネクションを使い回す
+        # （SQL結果キャッシュ有効時はキャッシュがないクエリのときだけ都度接続する）
+        # universal_test（pandas/LightGBM/psycopg2）は実行対象があるときだけ読み込む
+        from sql_cache import is_sql_cache_enabled
+        from universal_test import create_db_connection
+        conn = None
+        if not is_sql_cache_enabled():
+            # 接続できなくても各テストは取得時に都度接続を試みる（エラーは各テストで表示される）
+            try:
+                conn = create_db_connection()
+            except Exception as e:
+                print(f"[ERROR] DB接続エラー: {e}")
+        
+        try:
+            current_year = None
+            for test_year, train_range, base_name, model_path in planned_runs:
+                if test_year != current_year:
+                    current_year = test_year
+                    print(f"\n{'='*60}")
+                    print(f"【{test_year}年テスト】 学習期間: {train_range}")
+                    print(f"{'='*60}")
+                
+                print(f"\n[RUN] {base_name} ({train_range} → {test_year}年)")
+                # 共有コネクションが切断されていたら張り直す
+                # （再接続できなければpredict_with_modelが取得時に都度接続する）
+                if conn is not None and conn.closed:
+                    print("[WARNING] DB接続が切断されていたため再接続します")
+                    try:
+                        conn = create_db_connection()
+                    except Exception as e:
+                        print(f"[ERROR] DB再接続エラー: {e}")
+                        conn = None
+                success = run_model_test(model_path, test_year, conn=conn)
+                
+                if success:
+                    results.append({
+                        'test_year': test_year,
+                        'train_range': train_range,
+                        'model': base_name
+                    })
+        finally:
+            if conn is not None:
+                conn.close()
+    else:
+        print("\n[SKIP] テスト対象のモデルファイルがありません。")
     
     print("\n" + "=" * 60)
     print("3年間テスト完了")
@@ -15,9 +15,10 @@ def main():
     print("期待値計算 実データテスト")
     print("=" * 80)
     
-    # predicted_results.tsvを読み込み
+    # predicted_results.tsvを読み込み（期待値計算で使う列だけ）
     print("\n[1] データ読み込み...")
-    df = pd.read_csv('results/predicted_results.tsv', sep='\t')
+    use_columns = ['開催年', '開催日', '競馬場', 'レース番号', '馬番', '予測スコア', '単勝オッズ', '確定着順']
+    df = pd.read_csv('results/predicted_results.tsv', sep='\t', usecols=use_columns)
     
     print(f"総レコード数: {len(df):,}")
     print(f"年別件数:")
@@ -42,7 +43,12 @@ def main():
     df_valid = df_renamed[
         (df_renamed['tansho_odds'].notna()) & 
         (df_renamed['tansho_odds'] > 0)
-    ].copy()
+    ].astype({
+        # 整数列だけ幅を縮めておく（着順は18以下なのでint8で足りる）
+        # オッズと予測スコアはfloat64のまま（float32だと999.9がmax_oddsを超えるなど境界判定と払戻額がずれる）
+        'chakujun_numeric': 'int8',
+        'kaisai_year': 'int16'
+    })
     
     print(f"\nオッズ有効データ: {len(df_valid):,}")
     
@@ -99,30 +105,31 @@ def main():
     best_threshold = optimization_result['recommendation']
     calculator.threshold = best_threshold
     
+    # 全レースの期待値をまとめて1回だけ計算し、購入推奨馬を年別に集計する
+    df_ev = calculator.calculate_expected_values(df_valid)
+    df_buy = df_ev[df_ev['should_buy']]
+    is_win = df_buy['chakujun_numeric'] == 1
+    year_stats = pd.DataFrame({
+        'kaisai_year': df_buy['kaisai_year'],
+        'is_win': is_win.astype(np.int64),
+        'payout': np.where(is_win, df_buy['tansho_odds'] * 100, 0.0)
+    }).groupby('kaisai_year').agg(
+        bets=('is_win', 'size'),
+        wins=('is_win', 'sum'),
+        total_return=('payout', 'sum')
+    )
+    
     for year in sorted(df_valid['kaisai_year'].unique()):
-        df_year = df_valid[df_valid['kaisai_year'] == year]
-        
-        race_groups = df_year.groupby(['kaisai_year', 'kaisai_date', 'keibajo_code', 'race_number'])
-        
-        total_bets = 0
-        total_wins = 0
-        total_investment = 0
-        total_return = 0
-        
-        for _, race_df in race_groups:
-            race_with_ev = calculator.calculate_race_expected_values(race_df)
-            buy_horses = race_with_ev[race_with_ev['should_buy']]
-            
-            if len(buy_horses) == 0:
-                continue
-            
-            for _, horse in buy_horses.iterrows():
-                total_bets += 1
-                total_investment += 100
-                
-                if horse['chakujun_numeric'] == 1:
-                    total_wins += 1
-                    total_return += horse['tansho_odds'] * 100
+        # 購入推奨馬がいない年は0件として扱う
+        if year in year_stats.index:
+            total_bets = int(year_stats.at[year, 'bets'])
+            total_wins = int(year_stats.at[year, 'wins'])
+            total_return = year_stats.at[year, 'total_return']
+        else:
+            total_bets = 0
+            total_wins = 0
+            total_return = 0
+        total_investment = total_bets * 100
         
         hit_rate = (total_wins / total_bets * 100) if total_bets > 0 else 0
         recovery_rate = (total_return / total_investment * 100) if total_investment > 0 else 0
@@ -9,7 +9,6 @@ model_creator.pyで作成したモデルを使用して予測を行い、結果
 
 import psycopg2
 import pandas as pd
-import pickle
 import lightgbm as lgb
 import numpy as np
 import os
@@ -18,6 +17,8 @@ from datetime import datetime
 from keiba_constants import get_track_name, format_model_description
 from model_config_loader import get_all_models, get_legacy_model
 from db_query_builder import build_race_data_query
+from sql_cache import read_sql_cached
+from model_loader import load_model
 
 # Phase 1: 期待値・ケリー基準・信頼度スコアの統合
 from expected_value_calculator import ExpectedValueCalculator
@@ -297,8 +298,25 @@ def save_results_with_append(df, filename, append_mode=True, output_dir='results
             df.to_csv(filepath, index=False, sep='\t', encoding='utf-8-sig')
 
 
+def create_db_connection():
+    """
+    PostgreSQLコネクションを作成
+
+    Returns:
+        psycopg2.connection: DBコネクション
+    """
+    return psycopg2.connect(
+        host='localhost',
+        port='5432',
+        user='postgres',
+        password='ahtaht88',
+        dbname='keiba'
+    )
+
+
 def predict_with_model(model_filename, track_code, kyoso_shubetsu_code, surface_type, 
-                      min_distance, max_distance, test_year_start=2023, test_year_end=2023):
+                      min_distance, max_distance, test_year_start=2023, test_year_end=2023,
+                      conn=None):
     """
     指定したモデルで予測を実行する汎用関数
     
@@ -311,20 +329,12 @@ def predict_with_model(model_filename, track_code, kyoso_shubetsu_code, surface_
         max_distance (int): 最大距離
         test_year_start (int): テスト対象開始年 (デフォルト: 2023)
         test_year_end (int): テスト対象終了年 (デフォルト: 2023)
+        conn: 使い回すDBコネクション（省略時はこの呼び出しの中で接続して閉じる）
         
     Returns:
         tuple: (予測結果DataFrame, サマリーDataFrame, レース数)
     """
     
-    # PostgreSQL コネクションの作成
-    conn = psycopg2.connect(
-        host='localhost',
-        port='5432',
-        user='postgres',
-        password='ahtaht88',
-        dbname='keiba'
-    )
-    
     # SQLクエリを共通化モジュールで生成
     # 注意: universal_test.pyでは払い戻し情報が必要なのでinclude_payout=True
     # また、year_start/year_endの範囲を広げて過去3年分も取得（past_avg_sotai_chakujun計算のため）
@@ -359,9 +369,9 @@ def predict_with_model(model_filename, track_code, kyoso_shubetsu_code, surface_
         f.write(f"\n{sql}\n")
     print(f"[NOTE] テスト用SQLをログファイルに出力: {log_filepath}")
 
-    # データを取得
-    df = pd.read_sql_query(sql=sql, con=conn)
-    conn.close()
+    # データを取得（KEIBA_SQL_CACHE=1 なら2回目以降はparquetキャッシュから読み込む）
+    # connが渡されていればそれを使い、なければ取得時だけ接続する（キャッシュヒット時は接続しない）
+    df = read_sql_cached(sql, conn=conn, connect=create_db_connection)
     
     if len(df) == 0:
         print(f"[ERROR] {model_filename} に対応するテストデータが見つかりませんでした。")
@@ -374,7 +384,7 @@ def predict_with_model(model_filename, track_code, kyoso_shubetsu_code, surface_
     df = preprocess_race_data(df, verbose=True)
 
     # 特徴量作成（共通化モジュール使用）
-    from feature_engineering import create_features, add_advanced_features
+    from feature_engineering import create_features, add_advanced_features, downcast_features
     
     # 基本特徴量を作成
     X = create_features(df)
@@ -395,10 +405,13 @@ def predict_with_model(model_filename, track_code, kyoso_shubetsu_code, surface_
     # 距離別特徴量選択はadd_advanced_features()内で実施済み
     print(f"\n[INFO] 特徴量リスト: {list(X.columns)}")
 
-    # モデルをロード
+    # 予測前に数値型を縮小（float64→float32）
+    # 速報予測（sokuho_prediction.py）と同じ入力で予測し、ここで調整した購入条件が速報でもそのまま使えるようにする
+    X = downcast_features(X)
+
+    # モデルをロード（同名の.txtがあればネイティブ形式、同じモデルはプロセス内でキャッシュ）
     try:
-        with open(model_filename, 'rb') as model_file:
-            model = pickle.load(model_file)
+        model = load_model(model_filename)
     except FileNotFoundError:
         print(f"[ERROR] モデルファイル {model_filename} が見つかりません。")
         return None, None, 0